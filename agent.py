@@ -1,11 +1,42 @@
-from datetime import datetime
-from typing import Dict
+import asyncio
+import contextlib
+import gc
+import hashlib
+import json
+import logging
+import time
+from dataclasses import replace
+from typing import AsyncIterator, Awaitable, Callable, List, Tuple
 
 import google.generativeai as genai
+from cachetools import LRUCache, TTLCache
+from google.api_core.exceptions import ResourceExhausted
+from google.generativeai import client as genai_client
 
-from exception import DoneForTheDayException
-from logger import gemini_agent_logger
+from exception import DoneForTheDayException, GeminiException
+from logger import ContextAdapter, gemini_agent_logger
 from models import Chat, File
+from rate_limiter import RateLimiter
+
+# retry configuration for requests rejected by the Gemini API with a 429
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+
+# least number of constructed models kept for reuse when switching models
+MODEL_POOL_SIZE = 8
+
+# collect the youngest gc generation after a sweep removes at least this many chats
+GC_SWEEP_THRESHOLD = 100
+
+# message of the exception raised once the daily request limit is reached
+DAILY_LIMIT_MESSAGE = "Daily limit has been reached."
+
+# instructions used to pack independent prompts into a single request
+MULTI_PROMPT_TEMPLATE = (
+    "Answer each of the following {count} prompts independently. "
+    "Respond with a JSON array of {count} strings, where the string at each index "
+    "is the answer to the prompt at the same index.\n{prompts}"
+)
 
 
 class GeminiAgent:
@@ -15,28 +46,75 @@ class GeminiAgent:
     Parameters:
     model_name (str): The identifier for the generative model to be utilized.
     daily_limit (int): The maximum number of requests allowed per day.
+    rpm_limit (int): The maximum number of requests allowed per minute.
+    tpm_limit (int): The maximum number of tokens allowed per minute.
+    max_concurrency (int): The maximum number of requests in flight at once.
+    max_chats (int): The maximum number of chat sessions kept in memory.
+    chat_ttl (float): The seconds a chat session is kept after its last message.
+    response_cache_size (int): The maximum number of responses kept for duplicate file requests.
+    response_cache_ttl (float): The seconds a cached response remains valid.
 
     Attributes:
             model (genai.GenerativeModel): The generative model used for chat interactions.
-            chats (Dict[str, Chat]): A dictionary storing chat sessions for users.
+            chats (TTLCache[str, Chat]): A bounded cache storing chat sessions for users.
             request_count (int): The current count of requests made.
 
     Methods:
             get_chat_for_user(username: str) -> Chat | None: Retrieves the chat session for a specific user.
             set_model(model_name: str): Sets a new generative model.
+            preload_models(model_names: List[str]): Constructs and pools generative models ahead of use.
             store_chat(chat: Chat): Stores a chat session.
             process_chat_prompt(username: str, prompt: str) -> str: Sends a chat interaction for a specific user.
+            stream_chat_prompt(username: str, prompt: str) -> AsyncIterator[str]: Sends a chat interaction and yields the response as it is generated.
             process_file_prompt(username: str, prompt: str, file: File) -> str: Sends a chat interaction with a file for a specific user.
+            aclose(): Closes the connection shared by all async Gemini calls.
+            generate_content_multi(prompts: List[str]) -> List[str]: Answers multiple independent prompts with a single request.
+            process_chat_prompts_batch(items: List[Tuple[str, str]]) -> List[str | Exception]: Sends multiple chat interactions concurrently.
+            process_file_prompts_batch(items: List[Tuple[str, str, File]]) -> List[str | Exception]: Sends multiple file interactions concurrently.
+            reset_request_count(): Resets the daily request count to 0.
+            erase_expired_chats() -> int: Erases the chats that have been idle longer than the chat ttl.
     """
 
+    # names are mangled to _GeminiAgent__<name> like the attributes assigned in __init__
+    __slots__ = (
+        "__model_pool",
+        "__model",
+        "__daily_limit",
+        "__accepted_models",
+        "__chats",
+        "__response_cache",
+        "__request_count",
+        "__semaphore",
+        "__limiter",
+    )
+
     def __init__(
-        self, model_name: str, daily_limit: int, accepted_models: list[str]
+        self,
+        model_name: str,
+        daily_limit: int,
+        accepted_models: list[str],
+        rpm_limit: int = 60,
+        tpm_limit: int = 100_000,
+        max_concurrency: int = 8,
+        max_chats: int = 1000,
+        chat_ttl: float = 86400,
+        response_cache_size: int = 10_000,
+        response_cache_ttl: float = 3600,
     ) -> None:
-        self.__model: genai.GenerativeModel = genai.GenerativeModel(model_name)
+        # bounded so arbitrary names passed to set_model cannot grow the pool forever
+        self.__model_pool: LRUCache[str, genai.GenerativeModel] = LRUCache(
+            maxsize=max(MODEL_POOL_SIZE, len(accepted_models))
+        )
+        self.__model: genai.GenerativeModel = self.__get_model(model_name)
         self.__daily_limit: int = daily_limit
         self.__accepted_models: list[str] = accepted_models
-        self.__chats: Dict[str, Chat] = dict()
+        self.__chats: TTLCache[str, Chat] = TTLCache(maxsize=max_chats, ttl=chat_ttl)
+        self.__response_cache: TTLCache[Tuple, str] = TTLCache(
+            maxsize=response_cache_size, ttl=response_cache_ttl
+        )
         self.__request_count: int = 0
+        self.__semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self.__limiter: RateLimiter = RateLimiter(rpm_limit, tpm_limit)
 
     """ Properties """
 
@@ -51,7 +129,7 @@ class GeminiAgent:
         self.set_model(model_name)
 
     @property
-    def chats(self) -> Dict[str, Chat]:
+    def chats(self) -> TTLCache[str, Chat]:
         return self.__chats
 
     @property
@@ -68,39 +146,188 @@ class GeminiAgent:
 
     """ Private Methods """
 
-    def __increment_request_count(self) -> None:
-        self.__request_count += 1
+    def __reserve_requests(self, count: int = 1) -> None:
+        """Reserves requests against the daily limit before any api call is awaited.
+        There is no await between the check and the increment, so concurrent callers cannot all pass the check.
+        """
+        self.__validate_request_limit(count)
+        self.__request_count += count
+
+    def __release_requests(self, count: int = 1) -> None:
+        """Returns reserved requests that did not complete."""
+        self.__request_count -= count
+
+    def __get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Returns the pooled model for the name, constructing it on first use."""
+        model = self.__model_pool.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            self.__model_pool[model_name] = model
+        return model
+
+    def __validate_request_limit(self, count: int = 1) -> None:
+        """Will throw DoneForTheDayException if the request limit will be exceeded by the next `count` requests."""
+        # compare the slots directly, skipping the property lookups on every request
+        if self.__request_count + count > self.__daily_limit:
+            raise DoneForTheDayException(
+                message=DAILY_LIMIT_MESSAGE, type=type(ValueError).__name__
+            )
 
-    def __upload_file(self, file_name: str, content_type: str):
-        file = genai.upload_file(path=file_name)
-        return File(file_name, file, content_type)
+    def __hash_prompt(self, prompt: str) -> str:
+        """Short digest used to correlate prompts in logs without logging their contents."""
+        return hashlib.blake2b(prompt.encode(), digest_size=8).hexdigest()
+
+    def __file_cache_key(self, prompt: str, file: File) -> Tuple | None:
+        """Builds the response cache key for a file prompt. Files without a digest are not cached."""
+        if file.digest is None:
+            return None
+        return (self.__model.model_name, prompt, file.digest)
+
+    async def __request_with_retry(
+        self, request: Callable[[], Awaitable], est_tokens: int
+    ):
+        """Runs a model request within the rate limits. Will retry with exponential backoff when rate limited."""
+        for attempt in range(MAX_RETRIES + 1):
+            await self.__limiter.acquire(est_tokens)
+            try:
+                return await request()
+            except ResourceExhausted:
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = RETRY_BASE_DELAY * 2**attempt
+                gemini_agent_logger.warning(
+                    "Rate limited by the Gemini API. Retrying request.",
+                    extra={"attempt": attempt + 1, "delay": delay},
+                )
+                await asyncio.sleep(delay)
+
+    def __record_usage(self, response, est_tokens: int) -> None:
+        # fall back to the estimate when the response carries no usage metadata
+        usage = getattr(response, "usage_metadata", None)
+        self.__limiter.record(usage.total_token_count if usage else est_tokens)
+
+    async def __call_model(self, request: Callable[[], Awaitable], est_tokens: int):
+        """Runs a model request within the concurrency and rate limits."""
+        async with self.__semaphore:
+            response = await self.__request_with_retry(request, est_tokens)
+            self.__record_usage(response, est_tokens)
+            return response
+
+    async def __stream_chat_message(
+        self, username: str, prompt: str
+    ) -> AsyncIterator[str]:
+        # Fetch existing chat data. If chat is None, then the user has no chat history, so we will create a new chat
+        if (chat := self.__chats.get(username)) is None:
+            # Start a new chat if no chat history exists for the user
+            session = self.__model.start_chat(history=[])
+            chat_logger = ContextAdapter(
+                gemini_agent_logger,
+                {"username": username, "model": self.__model.model_name},
+            )
+            chat = Chat(username, session, time.time(), None, logger=chat_logger)
+            self.store_chat(chat)
 
-    def __delete_file(file_name: str) -> None:
-        genai.delete_file(file_name)
+        est_tokens = len(prompt) // 4
+        # the permit is held until the stream is exhausted, not just until the first chunk
+        async with self.__semaphore:
+            response = await self.__request_with_retry(
+                lambda: chat.session.send_message_async(prompt, stream=True),
+                est_tokens,
+            )
+            completed = False
+            try:
+                async for chunk in response:
+                    yield chunk.text
+                completed = True
+            finally:
+                # the session holds the exchange as pending until the response is read in full. a failed send
+                # leaves the history untouched, so only a stream that was not consumed needs to be dropped.
+                # ChatSession.rewind() reads the pending response, which raises while a stream is unfinished,
+                # so the pending pair is cleared the way rewind() does instead
+                if not completed:
+                    chat.session._last_sent = None
+                    chat.session._last_received = None
+            self.__record_usage(response, est_tokens)
+
+        # chats are immutable, so build the updated record from the latest stored one.
+        # a chat erased or replaced while the response streamed is not brought back
+        current = self.__chats.get(username)
+        if current is not None and current.session is chat.session:
+            # each exchange adds the user prompt and the model reply to the history
+            chat = replace(
+                current,
+                last_message=time.time(),
+                history_length=current.history_length + 2,
+            )
+            # reinsert the chat to refresh its ttl and recency in the cache
+            self.__chats[username] = chat
+        # log the chat message sent, only building the payload if it will be emitted
+        if gemini_agent_logger.isEnabledFor(logging.INFO):
+            chat.logger.info(
+                "Chat message sent.",
+                extra={
+                    "prompt_length": len(prompt),
+                    "prompt_hash": self.__hash_prompt(prompt),
+                    "history_length": chat.history_length,
+                },
+            )
 
-    def __validate_request_limit(self) -> None:
-        """Will throw DoneForTheDayException if the request limit will be exceeded."""
-        less_than_limit = self.request_count + 1 <= self.daily_limit
-        if not less_than_limit:
-            raise DoneForTheDayException(
-                message="Daily limit has been reached.", type=type(ValueError).__name__
+    async def __send_chat_message(self, username: str, prompt: str) -> str:
+        # consume the stream so there is a single code path for chat messages
+        chunks = [chunk async for chunk in self.__stream_chat_message(username, prompt)]
+        return "".join(chunks)
+
+    async def __generate_file_content(
+        self, username: str, prompt: str, file: File
+    ) -> str:
+        # generate the response using the file and text prompt
+        response = await self.__call_model(
+            lambda: self.__model.generate_content_async([file.content, prompt]),
+            est_tokens=len(prompt) // 4,
+        )
+        # close the file since we dont need it any more
+        file.close()
+        if gemini_agent_logger.isEnabledFor(logging.INFO):
+            gemini_agent_logger.info(
+                "Content generated using file and text prompt.",
+                extra={
+                    "username": username,
+                    "prompt_length": len(prompt),
+                    "prompt_hash": self.__hash_prompt(prompt),
+                    "filename": file.name,
+                    "responseLength": len(response.text),
+                },
             )
+        return response.text
 
     """ Public Methods """
 
     def get_chat_for_user(self, username: str) -> Chat | None:
-        return self.chats.get(username, None)
+        return self.__chats.get(username)
 
     def set_model(self, model_name: str) -> None:
-        self.__model = genai.GenerativeModel(model_name)
+        self.__model = self.__get_model(model_name)
+        gemini_agent_logger.info(
+            "A new model has been set.", extra={"model_name": model_name}
+        )
+
+    async def aclose(self) -> None:
+        """Closes the gRPC channel that every pooled model shares for async calls."""
+        async_client = genai_client.get_default_generative_async_client()
+        await async_client.transport.close()
+        gemini_agent_logger.info("The Gemini connection has been closed.")
+
+    def preload_models(self, model_names: List[str]) -> None:
+        for model_name in model_names:
+            self.__get_model(model_name)
         gemini_agent_logger.info(
-            "A new model has been set.", extra=dict(model_name=model_name)
+            "Models have been preloaded.", extra={"model_names": model_names}
         )
 
     def add_model(self, model_name: str) -> None:
         self.__accepted_models.append(model_name)
         gemini_agent_logger.info(
-            "A new model has been added.", extra=dict(model_name=model_name)
+            "A new model has been added.", extra={"model_name": model_name}
         )
 
     def store_chat(self, chat: Chat):
@@ -115,16 +342,41 @@ class GeminiAgent:
         if chat:
             gemini_agent_logger.info(
                 "Chat history has been deleted.",
-                extra=dict(chat_info=chat.serialize()),
+                extra={"chat_info": chat.serialize()},
             )
 
+    def reset_request_count(self) -> None:
+        count = self.__request_count
+        self.__request_count = 0
+        gemini_agent_logger.info(
+            "Request count has been reset.", extra={"request_count": count}
+        )
+
     def remove_all_chats(self) -> None:
         chats = len(self.chats)
         self.chats.clear()
         gemini_agent_logger.info(
-            "All chats have been erased.", extra=dict(chats_deleted=chats)
+            "All chats have been erased.", extra={"chats_deleted": chats}
         )
 
+    def erase_expired_chats(self) -> int:
+        """Erases the chats that have been idle for longer than the chat ttl.
+        The chat cache only drops expired chats when it is next written to, so without a sweep a quiet bot
+        would keep their sessions in memory. Only the expired chats are visited.\n
+        Returns:
+            The amount of chats erased.
+        """
+        expired = self.__chats.expire()
+        for _, chat in expired:
+            gemini_agent_logger.info(
+                "Chat history has been deleted.",
+                extra={"chat_info": chat.serialize()},
+            )
+
+        if len(expired) >= GC_SWEEP_THRESHOLD:
+            gc.collect(generation=0)
+        return len(expired)
+
     async def process_chat_prompt(self, username: str, prompt: str) -> str:
         """Sends a chat interaction for a specific user.\n
         Args:
@@ -133,28 +385,35 @@ class GeminiAgent:
         Returns:
             The text response generated by the chat model.
         """
-        self.__validate_request_limit()
-
-        # Fetch existing chat data
-        chat = self.get_chat_for_user(username)
-        # If chat is None, then the user has no chat history, so we will create a new chat
-        if chat is None:
-            # Start a new chat if no chat history exists for the user
-            chat = self.__model.start_chat(history=[])
-            chat = Chat(username, chat, datetime.now(), None)
-            self.store_chat(chat)
-
-        response = await chat.session.send_message_async(prompt)
-        # set the last message time to now
-        chat.last_message = datetime.now()
-        # log the chat message sent
-        gemini_agent_logger.info(
-            "Chat message sent.",
-            extra=dict(username=username, prompt=prompt, chat=chat.serialize()),
-        )
-        # increment request count
-        self.__increment_request_count()
-        return response.text
+        self.__reserve_requests()
+        try:
+            return await self.__send_chat_message(username, prompt)
+        except Exception:
+            self.__release_requests()
+            raise
+
+    async def stream_chat_prompt(
+        self, username: str, prompt: str
+    ) -> AsyncIterator[str]:
+        """Sends a chat interaction for a specific user and yields the response as it is generated.
+        The iterator must be exhausted or closed so its concurrency permit is released.\n
+        Args:
+            username: The name of the user.
+            prompt: The message to send within the chat.
+        Yields:
+            The text chunks generated by the chat model.
+        """
+        self.__reserve_requests()
+        try:
+            # closing this generator early must also close the inner stream, which holds the concurrency permit
+            async with contextlib.aclosing(
+                self.__stream_chat_message(username, prompt)
+            ) as stream:
+                async for chunk in stream:
+                    yield chunk
+        except Exception:
+            self.__release_requests()
+            raise
 
     async def process_file_prompt(
         self,
@@ -170,19 +429,103 @@ class GeminiAgent:
         Returns:
             The text response generated by the chat model.
         """
-        self.__validate_request_limit()
+        key = self.__file_cache_key(prompt, file)
+        cached = self.__response_cache.get(key) if key else None
+        if cached is not None:
+            file.close()
+            gemini_agent_logger.info(
+                "File response served from cache.",
+                extra={"username": username, "filename": file.name},
+            )
+            return cached
+
+        self.__reserve_requests()
+        try:
+            response = await self.__generate_file_content(username, prompt, file)
+        except Exception:
+            self.__release_requests()
+            raise
+
+        if key:
+            self.__response_cache[key] = response
+        return response
+
+    async def process_chat_prompts_batch(
+        self, items: List[Tuple[str, str]]
+    ) -> List[str | Exception]:
+        """Sends multiple chat interactions concurrently.\n
+        Args:
+            items: A list of (username, prompt) pairs.
+        Returns:
+            The text responses in the same order as the items. A failed request is returned as its exception.
+        """
+        # reserve the whole batch up front so concurrent sends cannot overshoot the limit
+        self.__reserve_requests(len(items))
+
+        tasks = [
+            self.__send_chat_message(username, prompt) for username, prompt in items
+        ]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        # only count the requests that were completed
+        self.__release_requests(
+            sum(isinstance(response, Exception) for response in responses)
+        )
+        return responses
 
-        # generate the response using the file and text prompt
-        response = await self.__model.generate_content_async([file.content, prompt])
-        # close the file since we dont need it any more
-        file.close()
+    async def process_file_prompts_batch(
+        self, items: List[Tuple[str, str, File]]
+    ) -> List[str | Exception]:
+        """Sends multiple file interactions concurrently.\n
+        Args:
+            items: A list of (username, prompt, file) tuples.
+        Returns:
+            The text responses in the same order as the items. A failed request is returned as its exception.
+        """
+        self.__reserve_requests(len(items))
+
+        tasks = [
+            self.__generate_file_content(username, prompt, file)
+            for username, prompt, file in items
+        ]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        self.__release_requests(
+            sum(isinstance(response, Exception) for response in responses)
+        )
+        return responses
+
+    async def generate_content_multi(self, prompts: List[str]) -> List[str]:
+        """Answers multiple independent prompts with a single request, so N prompts cost one request against the rpm and daily limits.\n
+        Args:
+            prompts: The prompts to answer. They must not depend on any chat history.
+        Returns:
+            The text responses in the same order as the prompts.
+        """
+        self.__reserve_requests()
+
+        request = MULTI_PROMPT_TEMPLATE.format(
+            count=len(prompts), prompts=json.dumps(prompts)
+        )
+        try:
+            response = await self.__call_model(
+                lambda: self.__model.generate_content_async(
+                    request,
+                    generation_config=dict(response_mime_type="application/json"),
+                ),
+                est_tokens=len(request) // 4,
+            )
+        except Exception:
+            self.__release_requests()
+            raise
+
+        answers = json.loads(response.text)
+        # the model must return exactly one answer per prompt, otherwise results cannot be mapped back
+        if not isinstance(answers, list) or len(answers) != len(prompts):
+            raise GeminiException(
+                message="Batched response does not match the prompts.",
+                type="ValueError",
+            )
         gemini_agent_logger.info(
-            "Content generated using file and text prompt.",
-            extra=dict(
-                username=username,
-                prompt=prompt,
-                filename=file.name,
-                responseLength=len(response.text),
-            ),
+            "Content generated for multiple prompts.",
+            extra={"prompt_count": len(prompts)},
         )
-        return response.text
+        return [str(answer) for answer in answers]
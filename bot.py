@@ -1,5 +1,10 @@
-from datetime import datetime
-from typing import Type
+import asyncio
+import contextlib
+import datetime
+import logging
+import re
+import time
+from typing import Final, Type
 
 import discord
 from discord.ext import commands, tasks
@@ -7,7 +12,26 @@ from discord.ext import commands, tasks
 from agent import GeminiAgent
 from exception import DiscordException, DoneForTheDayException
 from logger import bot_logger
-from utils import get_file, get_time_delta
+from utils import get_file
+
+# leading user mention, in both the plain and the nickname format, along with the whitespace after it
+MENTION_PATTERN: Final[re.Pattern] = re.compile(r"<@!?\d+>\s*")
+# prompts outside [MIN_PROMPT_LENGTH, MAX_PROMPT_LENGTH) characters are rejected before reaching the agent
+MIN_PROMPT_LENGTH: Final[int] = 1
+MAX_PROMPT_LENGTH: Final[int] = 1000
+# time of day the daily request count is reset. must be timezone aware, naive times make tasks.loop misfire
+RESET_TIME: Final[datetime.time] = datetime.time(
+    hour=0, minute=0, second=0, tzinfo=datetime.timezone.utc
+)
+# a streamed reply is edited once this many new characters arrived, and never more than once per interval (seconds)
+STREAM_EDIT_CHARS: Final[int] = 200
+STREAM_EDIT_INTERVAL: Final[float] = 1.0
+# mentions generated by the model must not notify anyone, only the reply to the author pings them
+RESPONSE_MENTIONS: Final[discord.AllowedMentions] = discord.AllowedMentions(
+    everyone=False, users=False, roles=False, replied_user=True
+)
+# longest message discord accepts, longer responses are split across several replies
+MESSAGE_LIMIT: Final[int] = 2000
 
 
 class Bot(commands.Bot):
@@ -18,14 +42,23 @@ class Bot(commands.Bot):
         *args,
         **kwargs,
     ):
+        # applies to every message the bot sends or edits, including the streamed replies
+        kwargs.setdefault("allowed_mentions", RESPONSE_MENTIONS)
         super().__init__(*args, **kwargs)
         self.__owner = owner
         self.__agent = agent
+        # snapshot of the bot user's id, taken once the connection is ready
+        self.__user_id: int | None = None
 
     """EVENTS"""
 
+    async def setup_hook(self) -> None:
+        """Registers the cogs within the bot's own event loop, before it connects to discord."""
+        await self.add_cog(BotCog(self))
+
     async def on_ready(self) -> None:
         """Event handler for when the bot is ready."""
+        self.__user_id = self.user.id
         bot_logger.info("Gemini bot is online")
 
     async def on_message(self, message: discord.Message) -> None:
@@ -46,103 +79,101 @@ class Bot(commands.Bot):
             DoneForTheDayException: If the request limit for the day has been met.
             DiscordException: If an exception occurs when making a request to the GeminiAPI.
         """
-        """Event handler for when a message is sent in the chat."""
+        # ignore messages created by the bot itself. comparing ids is cheaper than comparing names
+        if message.author.id == self.__user_id:
+            return await self.process_commands(message)
+        # since the bot was not mentioned, continue processing as expected by the framework
+        if self.__user_id not in {user.id for user in message.mentions}:
+            return await self.process_commands(message)
+
         username = message.author.name
 
-        # if the bot was mentioned in the message and the message was not created by the bot itself
-        if self.user.mentioned_in(message) and username != self.user.name:
+        content, request_type = None, None
 
-            prompt, content, request_type = None, None, None
+        prompt = self.__parse_prompt(message.content)
+        # if only whitespace follows the mention, no prompt was provided
+        if prompt is None:
+            await message.reply("No prompt was provided.")
+            return
 
-            # if the message contains <@MEMBER_ID> (when the bot is mentioned), split at > and return the rest
-            if message.content.startswith("<@"):
-                message_array = message.content.split("> ")
-                # if the message array is less than or equal to 1, no prompt was provided
-                if len(message_array) <= 1:
-                    await message.reply("No prompt was provided.")
-                    return
+        # ensure the prompt has at minimum 1 character and stays under the max length (to avoid wasting tokens)
+        if not MIN_PROMPT_LENGTH <= len(prompt) < MAX_PROMPT_LENGTH:
+            # reply to the user with the error message
+            await message.reply("Invalid prompt")
+            return
 
-                prompt = message_array[1]
-            else:  # otherwise it is a reply to a previous message, therefore will not include member Id
-                prompt = message.content
-
-            # ensure that there is at minimum 1 character in the prompt (to avoid wasting tokens)
-            if not prompt or len(prompt) < 1:
-                # reply to the user with the error message
-                await message.reply("Invalid prompt")
-                return
-
-            try:
-                start_time = datetime.now()
-                # if the message has attachments, process the image prompt via the vision agent. Will throw exception if not an image
-                if message.attachments:
-                    attachments_length = len(message.attachments)
-                    # if more than one message, reply to user letting them know only one file is accepted at a time
-                    if attachments_length > 1:
-                        await message.reply(
-                            f"Only one file can be processed at a time."
-                        )
-                        bot_logger.error(
-                            "Only one file can be processed at a time.",
-                            extra=dict(file_count=attachments_length),
-                        )
-                        return
-                    # set the request type for logging
-                    request_type = "vision"
-                    # by this point there will only be one attachemnt, otherwise we would have responded to the user
-                    attachment = message.attachments[0]
-                    # process the file prompt and store the response as content
-                    content = await self.process_file_prompt(
-                        username, prompt, attachment
+        try:
+            start_time = time.perf_counter_ns()
+            # if the message has attachments, process the image prompt via the vision agent. Will throw exception if not an image
+            if message.attachments:
+                attachments_length = len(message.attachments)
+                # if more than one message, reply to user letting them know only one file is accepted at a time
+                if attachments_length > 1:
+                    await message.reply("Only one file can be processed at a time.")
+                    bot_logger.error(
+                        "Only one file can be processed at a time.",
+                        extra={"file_count": attachments_length},
                     )
-                else:
-                    # else send chat request to the chat agent and log the response
-                    request_type = "chat"
-                    content = await self.process_chat_prompt(username, prompt)
-
-                end_time = datetime.now()
+                    return
+                # set the request type for logging
+                request_type = "vision"
+                # by this point there will only be one attachemnt, otherwise we would have responded to the user
+                attachment = message.attachments[0]
+                # process the file prompt and store the response as content
+                content = await self.process_file_prompt(username, prompt, attachment)
+                # discord rejects empty messages, so an empty response still gets a reply
+                if not content:
+                    content = "No response was generated."
+                # reply to the user with the content, split to fit within discord's message limit
+                for start in range(0, len(content), MESSAGE_LIMIT):
+                    await message.reply(content[start : start + MESSAGE_LIMIT])
+            else:
+                # else stream the chat response into a reply as it is generated
+                request_type = "chat"
+                await self.stream_chat_prompt(username, prompt, message)
+
+            # only build the per message log payload when it will actually be emitted
+            if bot_logger.isEnabledFor(logging.INFO):
                 # calculate runtime in milliseconds
-                runtime = int((end_time.timestamp() - start_time.timestamp()) * 1000)
-
+                runtime = (time.perf_counter_ns() - start_time) // 1_000_000
                 bot_logger.info(
                     "Processed content request.",
-                    extra=dict(
-                        requestType=request_type,
-                        username=username,
-                        runtime=runtime,
-                        requestCount=self.agent.request_count,
-                    ),
+                    extra={
+                        "requestType": request_type,
+                        "username": username,
+                        "runtime": runtime,
+                        "requestCount": self.agent.request_count,
+                    },
                 )
-                # reply to the user with the content
-                await message.reply(f"{content}")
-            # handle exceptions for exceeding GeminiAPI request limit
-            except DoneForTheDayException as e:
-                bot_logger.error(
-                    f"The request limit for today has been met.",
-                    extra=dict(
-                        exception=e.serialize(), username=username, prompt=prompt
-                    ),
-                )
-                await message.reply(f"I am done for the day. Check back later.")
-            # handle exceptions for exceeding GeminiAPI request limit
-            except DiscordException as e:
-                bot_logger.error(
-                    f"An exception occured when making a {request_type} request.",
-                    extra=dict(
-                        exception=e.serialize(), username=username, prompt=prompt
-                    ),
-                )
-                await message.reply(f"{e.message}")
-        else:
-            # since the bot was not mentioned, continue processing as expected by the framework
-            await self.process_commands(message)
+        # handle exceptions for exceeding GeminiAPI request limit
+        except DoneForTheDayException as e:
+            bot_logger.error(
+                "The request limit for today has been met.",
+                extra={
+                    "exception": e.serialize(),
+                    "username": username,
+                    "prompt": prompt,
+                },
+            )
+            await message.reply("I am done for the day. Check back later.")
+        # handle exceptions for exceeding GeminiAPI request limit
+        except DiscordException as e:
+            bot_logger.error(
+                f"An exception occured when making a {request_type} request.",
+                extra={
+                    "exception": e.serialize(),
+                    "username": username,
+                    "prompt": prompt,
+                },
+            )
+            await message.reply(e.message)
 
     async def on_member_remove(self, member: discord.Member):
         """Event handler for when a member leaves the server."""
         if not member.bot:
             self.agent.remove_chat(member.name)
             bot_logger.info(
-                f"Removed chat for member that left.", extra=dict(username=member.name)
+                "Removed chat for member that left.", extra={"username": member.name}
             )
 
     """METHODS"""
@@ -152,32 +183,88 @@ class Bot(commands.Bot):
         return self.__owner
 
     @owner.setter
-    def set_owner(self, owner: str):
+    def owner(self, owner: str):
         self.__owner = owner
 
     @property
     def agent(self) -> GeminiAgent:
         return self.__agent
 
-    async def process_chat_prompt(
-        self, username: str, prompt: str
+    def __parse_prompt(self, text: str) -> str | None:
+        """Strips the leading mention and surrounding whitespace from the message content.
+        Returns None if only whitespace is left, so a blank prompt never wastes a request.
+        """
+        # if the message starts with a <@MEMBER_ID> or <@!MEMBER_ID> mention, strip it and return the rest
+        mention = MENTION_PATTERN.match(text)
+        if mention:
+            # the pattern already consumed the whitespace after the mention
+            return text[mention.end() :].rstrip() or None
+        # otherwise it is a reply to a previous message, therefore will not include member Id
+        return text.strip() or None
+
+    async def close(self) -> None:
+        """Closes the gemini agent connection before shutting down the bot."""
+        # the discord connection is closed even if the agent fails to shut down cleanly
+        try:
+            await self.agent.aclose()
+        finally:
+            await super().close()
+
+    async def stream_chat_prompt(
+        self, username: str, prompt: str, message: discord.Message
     ) -> str | Type[DiscordException]:
-        """Processes a chat prompt sent by a user."""
+        """Processes a chat prompt sent by a user, editing a placeholder reply as the response is generated."""
+        replies = [await message.reply("\u2026")]
+        # offset is where the text shown in the latest reply starts
+        content, offset, edited_length, last_edit = "", 0, 0, time.monotonic()
         try:
-            response = await self.agent.process_chat_prompt(username, prompt)
-            return response
+            # close the stream even when an edit or reply fails, so its concurrency permit is released
+            async with contextlib.aclosing(
+                self.agent.stream_chat_prompt(username, prompt)
+            ) as stream:
+                async for chunk in stream:
+                    content += chunk
+                    now = time.monotonic()
+                    # once the latest reply is full, finish it and continue the response in a new reply
+                    while len(content) - offset > MESSAGE_LIMIT:
+                        await replies[-1].edit(
+                            content=content[offset : offset + MESSAGE_LIMIT]
+                        )
+                        offset += MESSAGE_LIMIT
+                        replies.append(
+                            await message.reply(
+                                content[offset : offset + MESSAGE_LIMIT]
+                            )
+                        )
+                        edited_length, last_edit = len(content), now
+                    # throttle the edits to stay within discord's per message edit rate limit
+                    if (
+                        len(content) - edited_length >= STREAM_EDIT_CHARS
+                        and now - last_edit >= STREAM_EDIT_INTERVAL
+                    ):
+                        await replies[-1].edit(content=content[offset:])
+                        edited_length, last_edit = len(content), now
         except Exception as e:
+            # the error is sent as a new reply, so drop the partial response
+            for reply in replies:
+                await reply.delete()
             raise DiscordException(message=str(e), type=type(e).__name__)
 
+        # discord rejects empty messages, so fall back to a notice when nothing was generated
+        await replies[-1].edit(content=content[offset:] or "No response was generated.")
+        return content
+
     async def process_file_prompt(
         self, username: str, prompt: str, attachment: discord.Attachment
     ) -> str | Type[DiscordException]:
         """Processes an image and prompt sent by a user."""
 
         try:
-            attachment_file = await attachment.to_file()
-            file = get_file(
-                attachment.filename, attachment_file, attachment.content_type
+            # read the attachment into a single buffer rather than wrapping it in a discord.File
+            data = await attachment.read()
+            # hashing and decoding the image is blocking, so run it in a worker thread
+            file = await asyncio.to_thread(
+                get_file, attachment.filename, data, attachment.content_type
             )
 
             response = await self.agent.process_file_prompt(username, prompt, file)
@@ -191,21 +278,30 @@ class Bot(commands.Bot):
 class BotCog(commands.Cog, name="BotCog"):
     """Cog implementation to run commands that are related to the Bot class. Will also run a background task to erase old chats."""
 
-    def __init__(self, bot: Bot, chat_ttl: int):
+    def __init__(self, bot: Bot):
         self.bot = bot
-        self.chat_ttl = chat_ttl
 
     def is_owner(self, ctx: commands.Context):
         return ctx.author.name == self.bot.owner
 
+    async def cog_load(self):
+        """Starts the background tasks. The cog is added from Bot.setup_hook, so the bot's event loop is already running."""
+        self.erase_old_chats.start()
+        self.reset_request_count.start()
+
+    async def cog_unload(self):
+        """Stops the background tasks when the cog is removed."""
+        self.erase_old_chats.cancel()
+        self.reset_request_count.cancel()
+
     @commands.command(name="set-owner", help="Set the owner of the bot.")
-    async def set_owner(self, ctx: commands.Context):
-        """Command to set the owner of the bot."""
+    async def set_owner(self, ctx: commands.Context, user: discord.User):
+        """Command to hand the ownership of the bot to another user."""
         if not self.is_owner(ctx):
             return
-        
-        user = ctx.author.name
-        self.bot.set_owner(user)
+
+        self.bot.owner = user.name
+        await ctx.reply("New owner set.")
 
     # add command to erase all chats manually. will only be accepted by the bot owner
     @commands.command(name="erase_chats", help="Erase all chats from the chat agent.")
@@ -218,33 +314,37 @@ class BotCog(commands.Cog, name="BotCog"):
 
     # add command to set a new generative model for the agent
     @commands.command(name="set_model", help="Set a new model for the gemini agent.")
-    async def set_chat_model(self, ctx: commands.Context):
+    async def set_chat_model(self, ctx: commands.Context, model_name: str):
         """Command to set a new generative model for the gemini agent."""
         if not self.is_owner(ctx):
             return
 
-        content = ctx.message.content
-        if content:
-            self.bot.agent.set_model(model_name=content)
-            await ctx.reply(f"New model set.")
+        # the model setter rejects names that are not in the accepted models list
+        try:
+            self.bot.agent.model = model_name
+        except ValueError as e:
+            await ctx.reply(str(e))
+            return
+        await ctx.reply("New model set.")
 
     @commands.command(
         name="add_model", help="Add a new model to the accepted models list."
     )
-    async def add_model(self, ctx: commands.Context):
+    async def add_model(self, ctx: commands.Context, model_name: str):
         """Command to add a new model to the accepted models list."""
         if not self.is_owner(ctx):
             return
 
-        content = ctx.message.content
-        if content:
-            self.bot.agent.add_model()
+        self.bot.agent.add_model(model_name)
 
     @tasks.loop(hours=2)
     async def erase_old_chats(self):
-        """This method erases the chat of any chat that has exceeded the ttl (time to live) of the last message"""
+        """This method erases the chat of any chat that has exceeded the ttl (time to live) of the last message.
+        The ttl is enforced by the agent's chat cache, so only the expired chats are visited.
+        """
+        self.bot.agent.erase_expired_chats()
 
-        for username, chat in self.bot.agent.chats.items():
-            duration = get_time_delta(chat.last_message, datetime.now())
-            if duration > self.chat_ttl:
-                self.bot.agent.remove_chat(username)
+    @tasks.loop(time=RESET_TIME)
+    async def reset_request_count(self):
+        """This method resets the daily request count of the gemini agent at midnight UTC."""
+        self.bot.agent.reset_request_count()
@@ -0,0 +1,41 @@
+import os
+from dataclasses import dataclass, field
+from typing import Tuple
+
+
+@dataclass(slots=True, frozen=True)
+class Config:
+    """Model to represent the bot configuration, parsed once from the environment at startup."""
+
+    owner: str
+    # how long the chat will live since last message, in hours
+    chat_ttl: int
+    model: str
+    accepted_models: Tuple[str, ...]
+    daily_limit: int
+    # maximum number of gemini requests in flight at once
+    max_concurrency: int
+    # maximum number of chat sessions kept in memory, least recently used are evicted first
+    max_chats: int
+    # whether to request the privileged message content intent. without it discord still sends the content of
+    # messages that mention the bot, but prefix commands stop working
+    message_content: bool
+    # kept out of the repr so the secrets never end up in logs
+    discord_token: str = field(repr=False)
+    google_api_key: str = field(repr=False)
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Builds the configuration from the environment. Raises KeyError naming the first required variable that is missing."""
+        return cls(
+            owner=os.environ["BOT_OWNER"],
+            chat_ttl=int(os.environ["CHAT_TTL"]),
+            model=os.environ["MODEL"],
+            accepted_models=tuple(os.environ["ACCEPTED_MODELS"].split(",")),
+            daily_limit=int(os.environ["DAILY_LIMIT"]),
+            max_concurrency=int(os.environ.get("MAX_CONCURRENCY", "8")),
+            max_chats=int(os.environ.get("MAX_CHATS", "1000")),
+            message_content=os.environ.get("MESSAGE_CONTENT", "true").lower() == "true",
+            discord_token=os.environ["DISCORD_TOKEN"],
+            google_api_key=os.environ["GOOGLE_API_KEY"],
+        )
@@ -2,6 +2,9 @@ from typing import Dict
 
 
 class BaseException(Exception):
+    # explicit slots keep exception instances from allocating their attribute dict
+    __slots__ = ("message", "type")
+
     def __init__(self, message: str, type: str):
         self.message = message
         self.type = type
@@ -14,21 +17,22 @@ class BaseException(Exception):
 class DiscordException(BaseException):
     """Custom exception class for the discord bot."""
 
-    pass
+    __slots__ = ()
 
 
 class GeminiException(BaseException):
     """Custom exception class for the gemini agent."""
 
-    pass
+    __slots__ = ()
 
 
 class FileProcessingException(BaseException):
     """Custom exception for when the file is unable to be processed"""
-    pass
+
+    __slots__ = ()
 
 
 class DoneForTheDayException(BaseException):
     """Custom Exception for when the GeminiAPI request limit has been exceeded"""
 
-    pass
+    __slots__ = ()
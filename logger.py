@@ -1,21 +1,80 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
+import orjson
 from pythonjsonlogger import jsonlogger
 
 
+def orjson_serializer(log_record, default=None, **kwargs) -> str:
+    """json.dumps compatible serializer backed by orjson. The stdlib specific options are ignored.
+    Records orjson cannot encode, such as integers wider than 64 bits, fall back to the stdlib encoder.
+    """
+    try:
+        return orjson.dumps(
+            log_record, default=default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+    except TypeError:
+        return json.dumps(log_record, default=default)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Queue handler that leaves the formatting to the handlers of the listener.
+    Only the message arguments are merged on the calling thread, so exc_info still reaches the json formatter.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 handler = logging.StreamHandler(stream=None)
 handler.setFormatter(
     jsonlogger.JsonFormatter(
         fmt="%(name)s %(asctime)s %(levelname)s %(message)s",
         rename_fields={"name": "logger", "asctime": "timestamp", "levelname": "level"},
+        json_serializer=orjson_serializer,
+        # orjson has no encoder class, so reuse the fallback encoding of the default json encoder
+        json_default=jsonlogger.JsonEncoder().default,
     )
 )
 
-bot_logger = logging.getLogger("bot-logger")
-bot_logger.addHandler(handler)
-bot_logger.setLevel(logging.INFO)
+# the event loop only enqueues records, formatting and the blocking write happen on the listener's thread
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+queue_handler = RecordQueueHandler(log_queue)
+listener = QueueListener(log_queue, handler, respect_handler_level=True)
+listener.start()
+# flush the records still queued when the process exits
+atexit.register(listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns the named logger writing through the shared queue to the json handler.
+    The handler is only attached once, and records do not propagate to the root logger, which discord.py
+    configures with its own handler, so each record is formatted and written exactly once.
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(queue_handler)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+bot_logger = get_logger("bot-logger")
+
+
+gemini_agent_logger = get_logger("gemini-agent")
+
 
+class ContextAdapter(logging.LoggerAdapter):
+    """Logger adapter that merges its bound context into the extra of every call."""
 
-gemini_agent_logger = logging.getLogger("gemini-agent")
-gemini_agent_logger.addHandler(handler)
-gemini_agent_logger.setLevel(logging.INFO)
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
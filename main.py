@@ -1,44 +1,46 @@
-import os
-import asyncio
+import sys
 
 import discord
 import google.generativeai as genai
 from dotenv import load_dotenv
 from agent import GeminiAgent
-from bot import Bot, BotCog
+from bot import Bot
+from config import Config
+from logger import queue_handler
 
 load_dotenv()
-# grab api keys from environment
-OWNER = os.getenv("BOT_OWNER")
-# how long the chat will live since last message
-CHAT_TTL = int(os.getenv("CHAT_TTL"))
-# gemini agent model configurations
-MODEL = os.getenv("MODEL")
-ACCEPTED_MODELS = os.getenv("ACCEPTED_MODELS").split(",")
-# daily request limit
-DAILY_LIMIT = int(os.getenv("DAILY_LIMIT"))
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# parse the configuration from the environment once. fails fast if a required variable is missing
+config = Config.from_env()
 
 # configure google genai
-genai.configure(api_key=GOOGLE_API_KEY)
+genai.configure(api_key=config.google_api_key)
 
 # initialize gemini agent instance for content generation
 gemini_agent = GeminiAgent(
-    model_name=MODEL, daily_limit=DAILY_LIMIT, accepted_models=ACCEPTED_MODELS
+    model_name=config.model,
+    daily_limit=config.daily_limit,
+    # the agent extends its accepted models at runtime, so it gets its own list
+    accepted_models=list(config.accepted_models),
+    max_concurrency=config.max_concurrency,
+    max_chats=config.max_chats,
+    chat_ttl=config.chat_ttl * 3600,
 )
+# warm the model pool so switching models does not pay construction cost
+gemini_agent.preload_models(config.accepted_models)
 
 # create intents object for discord bot initialization
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = config.message_content
 
-# create bot instance
-bot = Bot(OWNER, gemini_agent, command_prefix="$", intents=intents)
-# initialize BogCog instance for bot commands and scheduled tasks
-bot_cog = BotCog(bot, CHAT_TTL)
-# register the cog
-asyncio.run(bot.add_cog(bot_cog))
+# create bot instance. the BotCog for bot commands and scheduled tasks is registered in its setup hook
+bot = Bot(config.owner, gemini_agent, command_prefix="$", intents=intents)
 
 if __name__ == "__main__":
+    # run the bot on uvloop's faster event loop. it is not available on windows, which keeps the default loop
+    if sys.platform != "win32":
+        import uvloop
+
+        uvloop.install()
     # run the bot
-    bot.run(token=DISCORD_TOKEN)
+    # route discord.py's own records through the logging queue as well
+    bot.run(token=config.discord_token, log_handler=queue_handler)
@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime
 from dataclasses import dataclass
 from typing import IO, Dict
@@ -5,13 +6,14 @@ from typing import IO, Dict
 import google.generativeai as genai
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class File:
     """Model to represent a file"""
 
     name: str
     content: IO
     content_type: str
+    digest: str | None = None
 
     def serialize(self):
         return {"name": self.name, "content_type": self.content_type}
@@ -20,19 +22,28 @@ class File:
         self.content.close()
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Chat:
-    """Model to  represent chat information for a user."""
+    """Model to  represent chat information for a user. Times are epoch timestamps in seconds.
+    Instances are immutable, use dataclasses.replace to record a new message."""
 
     username: str
     session: genai.ChatSession
-    creation_time: datetime
-    last_message: datetime
+    creation_time: float
+    last_message: float | None
+    # running count of history entries so serialize() doesn't need the session history
+    history_length: int = 0
+    # logger bound to the invariant chat context (username and model)
+    logger: logging.LoggerAdapter | None = None
 
     def serialize(self) -> Dict:
         return {
             "username": self.username,
-            "creation_time": self.creation_time,
-            "last_message": self.last_message,
-            "history": len(self.session.history),
+            "creation_time": datetime.fromtimestamp(self.creation_time).isoformat(),
+            "last_message": (
+                datetime.fromtimestamp(self.last_message).isoformat()
+                if self.last_message
+                else None
+            ),
+            "history": self.history_length,
         }
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+
+class RateLimiter:
+    """
+    Sliding window limiter for requests per minute (RPM) and tokens per minute (TPM).
+
+    Parameters:
+    rpm_limit (int): The maximum number of requests allowed within the window.
+    tpm_limit (int): The maximum number of tokens allowed within the window.
+
+    Methods:
+            acquire(est_tokens: int): Waits until a request of the estimated size fits within the window.
+            record(tokens: int): Records the tokens consumed by a completed request.
+    """
+
+    WINDOW: float = 60.0
+
+    def __init__(self, rpm_limit: int, tpm_limit: int) -> None:
+        self.__rpm_limit: int = rpm_limit
+        self.__tpm_limit: int = tpm_limit
+        self.__requests: Deque[float] = deque()
+        self.__tokens: Deque[Tuple[float, int]] = deque()
+        self.__token_count: int = 0
+        self.__lock: asyncio.Lock = asyncio.Lock()
+
+    """ Private Methods """
+
+    def __evict(self, now: float) -> None:
+        """Drops every request and token entry that has left the window."""
+        while self.__requests and now - self.__requests[0] >= self.WINDOW:
+            self.__requests.popleft()
+        while self.__tokens and now - self.__tokens[0][0] >= self.WINDOW:
+            _, tokens = self.__tokens.popleft()
+            self.__token_count -= tokens
+
+    def __has_capacity(self, est_tokens: int) -> bool:
+        if len(self.__requests) >= self.__rpm_limit:
+            return False
+        # always let a request through on an empty window, even when it is larger than the limit
+        return not self.__tokens or self.__token_count + est_tokens <= self.__tpm_limit
+
+    def __wait_time(self, now: float) -> float:
+        """Returns the seconds until the oldest entry blocking the next request leaves the window."""
+        oldest = []
+        if len(self.__requests) >= self.__rpm_limit:
+            oldest.append(self.__requests[0])
+        if self.__tokens:
+            oldest.append(self.__tokens[0][0])
+        return max(min(oldest) + self.WINDOW - now, 0.01)
+
+    """ Public Methods """
+
+    async def acquire(self, est_tokens: int = 0) -> None:
+        """Waits until a request of the estimated size fits within the rpm and tpm limits.\n
+        Args:
+            est_tokens: The estimated amount of tokens the request will consume.
+        """
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                self.__evict(now)
+                if self.__has_capacity(est_tokens):
+                    self.__requests.append(now)
+                    return
+                await asyncio.sleep(self.__wait_time(now))
+
+    def record(self, tokens: int) -> None:
+        """Records the tokens consumed by a completed request.\n
+        Args:
+            tokens: The amount of tokens the request consumed.
+        """
+        self.__tokens.append((time.monotonic(), tokens))
+        self.__token_count += tokens
@@ -0,0 +1,37 @@
+import io
+import unittest
+
+from PIL import Image
+
+from exception import FileProcessingException
+from utils import ALLOWED_FILE_TYPES, get_file
+
+
+def encode_image(content_type: str) -> bytes:
+    """Encodes a small image in the format of the content type."""
+    buffer = io.BytesIO()
+    image_format = "PNG" if content_type == "image/png" else "JPEG"
+    Image.new("RGB", (8, 8)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class GetFileTest(unittest.TestCase):
+    def test_allowed_file_types_are_processed(self):
+        for content_type in ALLOWED_FILE_TYPES:
+            with self.subTest(content_type=content_type):
+                file = get_file("image", encode_image(content_type), content_type)
+                self.assertEqual(file.content_type, content_type)
+                self.assertIsNotNone(file.digest)
+
+    def test_other_file_types_are_not_supported(self):
+        for content_type in ("video/mp4", "audio/mp3", "text/plain; charset=utf-8"):
+            with self.subTest(content_type=content_type):
+                with self.assertRaises(FileProcessingException) as context:
+                    get_file("file", b"content", content_type)
+                self.assertEqual(
+                    context.exception.message, "That filetype is not supported."
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()